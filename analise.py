@@ -0,0 +1,169 @@
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+import math
+
+# =====================================================
+# ANÁLISE DE SEGMENTOS (sem dependência do Flask)
+# =====================================================
+# Funções que recebem qualquer objeto com `execute` do SQLAlchemy (Session da
+# aplicação web ou Connection do coletor)
+
+# Retorno diário via LAG por índice e volatilidade móvel de 21 pregões
+# (mínimo de 5 retornos); só a linha agregada trafega pela rede
+_Q_SEG_METRICAS = text('''
+    WITH Retornos AS (
+        SELECT
+            hp.IdIndice,
+            hp.DataQuotacao,
+            CAST(hp.Fechamento AS FLOAT) AS Fechamento,
+            hp.Volume,
+            (CAST(hp.Fechamento AS FLOAT)
+                / NULLIF(LAG(CAST(hp.Fechamento AS FLOAT))
+                    OVER (PARTITION BY hp.IdIndice ORDER BY hp.DataQuotacao), 0) - 1) * 100 AS Retorno
+        FROM HistoricoPrecos hp
+        INNER JOIN IndicesSegmentos seg ON hp.IdIndice = seg.IdIndice
+        WHERE seg.IdSegmento = :id_segmento
+        AND hp.DataQuotacao >= :data_inicio
+    ),
+    Janelas AS (
+        SELECT
+            Fechamento,
+            Volume,
+            Retorno,
+            CASE
+                WHEN COUNT(Retorno) OVER (PARTITION BY IdIndice ORDER BY DataQuotacao
+                                          ROWS BETWEEN 20 PRECEDING AND CURRENT ROW) >= 5
+                THEN STDEV(Retorno) OVER (PARTITION BY IdIndice ORDER BY DataQuotacao
+                                          ROWS BETWEEN 20 PRECEDING AND CURRENT ROW)
+            END AS Volatilidade21,
+            ROW_NUMBER() OVER (PARTITION BY IdIndice ORDER BY DataQuotacao DESC) AS Recencia
+        FROM Retornos
+    )
+    SELECT
+        AVG(Retorno) AS RetornoMedio,
+        STDEV(Retorno) AS VolatilidadeMedia,
+        AVG(CASE WHEN Recencia = 1 THEN Volatilidade21 END) AS VolatilidadeRolling,
+        MAX(Fechamento) AS PrecoMaximo,
+        MIN(Fechamento) AS PrecoMinimo,
+        SUM(Volume) AS VolumeTotal,
+        COUNT(*) AS TotalRegistros
+    FROM Janelas
+''')
+
+# Upsert da análise do dia: uma linha por (segmento, data da análise)
+_Q_MERGE_OPORTUNIDADE = text('''
+    MERGE OportunidadesInvestimento WITH (HOLDLOCK) AS t
+    USING (SELECT :id_segmento AS IdSegmento, :data_analise AS DataAnalise) AS s
+    ON t.IdSegmento = s.IdSegmento AND t.DataAnalise = s.DataAnalise
+    WHEN MATCHED THEN
+        UPDATE SET Titulo = :titulo,
+                   Descricao = :descricao,
+                   TipoOportunidade = :tipo,
+                   PotencialRetorno = :potencial_retorno,
+                   NivelRisco = :nivel_risco,
+                   Confianca = :confianca,
+                   Ativo = 1
+    WHEN NOT MATCHED THEN
+        INSERT (IdSegmento, Titulo, Descricao, TipoOportunidade, DataAnalise,
+                PotencialRetorno, NivelRisco, Confianca, Ativo)
+        VALUES (s.IdSegmento, :titulo, :descricao, :tipo, s.DataAnalise,
+                :potencial_retorno, :nivel_risco, :confianca, 1);
+''')
+
+def calcular_metricas_segmento(conn, id_segmento):
+    """Calcula métricas do segmento (agregadas no próprio SQL Server)"""
+    data_inicio = datetime.now() - timedelta(days=365)
+    
+    resultado = conn.execute(
+        _Q_SEG_METRICAS, {'id_segmento': id_segmento, 'data_inicio': data_inicio}
+    ).one()
+    
+    if not resultado.TotalRegistros:
+        return None
+    
+    def valor(v):
+        return v if v is not None else math.nan
+    
+    metricas = {
+        'RetornoMedio': valor(resultado.RetornoMedio),
+        'VolatilidadeMedia': valor(resultado.VolatilidadeMedia),
+        'VolatilidadeRolling': valor(resultado.VolatilidadeRolling),
+        'PrecoMaximo': valor(resultado.PrecoMaximo),
+        'PrecoMinimo': valor(resultado.PrecoMinimo),
+        'VolumeTotal': resultado.VolumeTotal or 0
+    }
+    
+    return metricas
+
+def gerar_oportunidades(id_segmento, metricas):
+    """Gera oportunidades de investimento baseado nas métricas do segmento"""
+    if not metricas:
+        return []
+    
+    oportunidades = []
+    
+    # Análise simplista de oportunidades
+    retorno_medio = metricas['RetornoMedio']
+    volatilidade = metricas['VolatilidadeMedia']
+    
+    # Determine tipo de oportunidade baseado em volatilidade e retorno
+    if retorno_medio > 2:
+        tipo = 'COMPRA'
+        potencial = retorno_medio * 1.5
+    elif retorno_medio < -1:
+        tipo = 'VENDA'
+        potencial = abs(retorno_medio) * 0.8
+    else:
+        tipo = 'HOLD'
+        potencial = retorno_medio
+    
+    # Nível de risco baseado em volatilidade
+    if volatilidade < 2:
+        risco = 'BAIXO'
+        confianca = 0.85
+    elif volatilidade < 5:
+        risco = 'MEDIO'
+        confianca = 0.70
+    else:
+        risco = 'ALTO'
+        confianca = 0.55
+    
+    oportunidade = {
+        'id_segmento': id_segmento,
+        'titulo': f'Oportunidade em Segmento',
+        'descricao': f'Análise baseada em {365} dias de dados históricos',
+        'tipo': tipo,
+        'potencial_retorno': float(potencial),
+        'nivel_risco': risco,
+        'confianca': float(confianca),
+        'metricas': metricas
+    }
+    
+    oportunidades.append(oportunidade)
+    return oportunidades
+
+def salvar_oportunidades(conn, id_segmento):
+    """
+    Gera as oportunidades do segmento e grava (upsert) a análise do dia.
+    O commit fica a cargo de quem chama.
+    """
+    metricas = calcular_metricas_segmento(conn, id_segmento)
+    oportunidades = gerar_oportunidades(id_segmento, metricas)
+    data_analise = date.today()
+    
+    def valor(v):
+        return None if v is None or math.isnan(v) else v
+    
+    for opp in oportunidades:
+        conn.execute(_Q_MERGE_OPORTUNIDADE, {
+            'id_segmento': id_segmento,
+            'data_analise': data_analise,
+            'titulo': opp['titulo'],
+            'descricao': opp['descricao'],
+            'tipo': opp['tipo'],
+            'potencial_retorno': valor(opp['potencial_retorno']),
+            'nivel_risco': opp['nivel_risco'],
+            'confianca': valor(opp['confianca'])
+        })
+    
+    return len(oportunidades)
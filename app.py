@@ -1,10 +1,16 @@
 from flask import Flask, render_template, request, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
 from sqlalchemy import text, func, desc
-import pandas as pd
 from datetime import datetime, timedelta
 import logging
+import os
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+import analise
 
 # =====================================================
 # CONFIGURAÇÃO INICIAL
@@ -20,11 +26,30 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    # Pool de conexões reaproveitado entre requisições (evita handshake ODBC a cada rota)
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'fast_executemany': True,
+    'query_cache_size': 1200,
     'connect_args': {'timeout': 30}
 }
 
 db = SQLAlchemy(app)
 
+# Cache de resultados das análises em disco, compartilhado com o coletor (que
+# invalida os segmentos atualizados ao fim de cada carga)
+app.config['CACHE_TYPE'] = 'FileSystemCache'
+app.config['CACHE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'web')
+app.config['CACHE_DEFAULT_TIMEOUT'] = 3600
+
+cache = Cache(app)
+
+# Períodos (em dias) aceitos pela API de gráfico
+PERIODOS_GRAFICO = (30, 90, 180, 365)
+
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -39,7 +64,7 @@ class Indices(db.Model):
     Ticker = db.Column(db.String(20), unique=True, nullable=False)
     Descricao = db.Column(db.String(100), nullable=False)
     Pais = db.Column(db.String(50), nullable=False)
-    DataCriacao = db.Column(db.DateTime, default=datetime.now)
+    DataCriacao = db.Column(db.DateTime, server_default=db.func.now())
     Ativo = db.Column(db.Boolean, default=True)
 
 class HistoricoPrecos(db.Model):
@@ -54,7 +79,7 @@ class HistoricoPrecos(db.Model):
     Fechamento = db.Column(db.Numeric(18,4))
     FechamentoAjustado = db.Column(db.Numeric(18,4))
     Volume = db.Column(db.BigInteger)
-    DataInsercao = db.Column(db.DateTime, default=datetime.now)
+    DataInsercao = db.Column(db.DateTime, server_default=db.func.now())
     
     indice = db.relationship('Indices', backref='historico_precos')
 
@@ -64,7 +89,7 @@ class SegmentosInvestimento(db.Model):
     IdSegmento = db.Column(db.Integer, primary_key=True)
     Nome = db.Column(db.String(100), unique=True, nullable=False)
     Descricao = db.Column(db.String(500))
-    DataCriacao = db.Column(db.DateTime, default=datetime.now)
+    DataCriacao = db.Column(db.DateTime, server_default=db.func.now())
     Ativo = db.Column(db.Boolean, default=True)
 
 class IndicesSegmentos(db.Model):
@@ -74,7 +99,7 @@ class IndicesSegmentos(db.Model):
     IdIndice = db.Column(db.Integer, db.ForeignKey('Indices.IdIndice'), nullable=False)
     IdSegmento = db.Column(db.Integer, db.ForeignKey('SegmentosInvestimento.IdSegmento'), nullable=False)
     Peso = db.Column(db.Numeric(5,2), default=100.00)
-    DataCriacao = db.Column(db.DateTime, default=datetime.now)
+    DataCriacao = db.Column(db.DateTime, server_default=db.func.now())
 
 class OportunidadesInvestimento(db.Model):
     __tablename__ = 'OportunidadesInvestimento'
@@ -85,13 +110,46 @@ class OportunidadesInvestimento(db.Model):
     Descricao = db.Column(db.String)
     TipoOportunidade = db.Column(db.String(50))
     DataAnalise = db.Column(db.Date, nullable=False)
-    PrecoPrevisto = db.Column(db.Numeric(18,4))
-    PotencialRetorno = db.Column(db.Numeric(5,2))
+    PrecoPrevisto = db.Column(db.Numeric(18,4, asdecimal=False))
+    PotencialRetorno = db.Column(db.Numeric(5,2, asdecimal=False))
     NivelRisco = db.Column(db.String(20))
-    Confianca = db.Column(db.Numeric(3,2))
-    DataCriacao = db.Column(db.DateTime, default=datetime.now)
+    Confianca = db.Column(db.Numeric(3,2, asdecimal=False))
+    DataCriacao = db.Column(db.DateTime, server_default=db.func.now())
     Ativo = db.Column(db.Boolean, default=True)
 
+# =====================================================
+# CONSULTAS SQL (compiladas uma única vez e reutilizadas)
+# =====================================================
+_Q_SEG_DATA = text('''
+    SELECT 
+        i.Ticker,
+        CONVERT(VARCHAR(10), hp.DataQuotacao, 23) AS DataQuotacao,
+        CAST(ISNULL(hp.Fechamento, 0) AS FLOAT) AS Fechamento
+    FROM HistoricoPrecos hp
+    INNER JOIN Indices i ON hp.IdIndice = i.IdIndice
+    INNER JOIN IndicesSegmentos seg ON i.IdIndice = seg.IdIndice
+    WHERE seg.IdSegmento = :id_segmento
+    AND hp.DataQuotacao >= :data_inicio
+    ORDER BY i.Ticker, hp.DataQuotacao
+''')
+
+_Q_INDICES_SEGMENTO = text('''
+    SELECT i.IdIndice, i.Ticker, i.Descricao, COUNT(hp.IdHistorico) as TotalRegistros
+    FROM Indices i
+    LEFT JOIN HistoricoPrecos hp ON i.IdIndice = hp.IdIndice
+    INNER JOIN IndicesSegmentos seg ON i.IdIndice = seg.IdIndice
+    WHERE seg.IdSegmento = :id_segmento
+    GROUP BY i.IdIndice, i.Ticker, i.Descricao
+''')
+
+_Q_SEGMENTOS_TOTAL_INDICES = text('''
+    SELECT s.IdSegmento, s.Nome, s.Descricao, COUNT(i.IdIndiceSegmento) AS TotalIndices
+    FROM SegmentosInvestimento s
+    LEFT JOIN IndicesSegmentos i ON i.IdSegmento = s.IdSegmento
+    WHERE s.Ativo = 1
+    GROUP BY s.IdSegmento, s.Nome, s.Descricao
+''')
+
 # =====================================================
 # SERVIÇOS DE ANÁLISE
 # =====================================================
@@ -103,109 +161,55 @@ class AnalisadorInvestimentos:
         """Obtém dados históricos de um segmento nos últimos N dias"""
         data_inicio = datetime.now() - timedelta(days=dias)
         
-        query = db.session.execute(text('''
-            SELECT 
-                i.Ticker,
-                i.Descricao,
-                hp.DataQuotacao,
-                hp.Fechamento,
-                hp.FechamentoAjustado,
-                hp.Volume,
-                hp.Alta,
-                hp.Baixa
-            FROM HistoricoPrecos hp
-            INNER JOIN Indices i ON hp.IdIndice = i.IdIndice
-            INNER JOIN IndicesSegmentos seg ON i.IdIndice = seg.IdIndice
-            WHERE seg.IdSegmento = :id_segmento
-            AND hp.DataQuotacao >= :data_inicio
-            ORDER BY i.Ticker, hp.DataQuotacao
-        '''), {'id_segmento': id_segmento, 'data_inicio': data_inicio})
+        query = db.session.execute(_Q_SEG_DATA, {'id_segmento': id_segmento, 'data_inicio': data_inicio})
         
         return query.fetchall()
     
     @staticmethod
+    @cache.memoize(timeout=3600)
     def calcular_metricas_segmento(id_segmento):
-        """Calcula métricas do segmento"""
-        dados = AnalisadorInvestimentos.obter_dados_segmento(id_segmento, dias=365)
-        
-        if not dados:
-            return None
-        
-        df = pd.DataFrame([
-            {
-                'Ticker': row[0],
-                'DataQuotacao': row[2],
-                'Fechamento': float(row[3]) if row[3] else 0,
-                'Volume': row[5]
-            }
-            for row in dados
-        ])
-        
-        if df.empty:
-            return None
-        
-        # Calcular retornos
-        df['Retorno'] = df.groupby('Ticker')['Fechamento'].pct_change() * 100
+        """Calcula métricas do segmento (agregadas no próprio SQL Server)"""
+        return analise.calcular_metricas_segmento(db.session, id_segmento)
+    
+    @staticmethod
+    @cache.memoize(timeout=900)
+    def obter_grafico_segmento(id_segmento, dias):
+        """Retorna o JSON (já serializado) com as séries de preços do segmento"""
+        dados = AnalisadorInvestimentos.obter_dados_segmento(id_segmento, dias=dias)
         
-        metricas = {
-            'RetornoMedio': df['Retorno'].mean(),
-            'VolatilidadeMedia': df['Retorno'].std(),
-            'PrecoMaximo': df['Fechamento'].max(),
-            'PrecoMinimo': df['Fechamento'].min(),
-            'VolumeTotal': df['Volume'].sum()
-        }
+        # Agrupar por ticker (as linhas já vêm ordenadas por Ticker, Data)
+        dados_agrupados = {}
+        for ticker, linhas in groupby(dados, key=itemgetter(0)):
+            _, datas, precos = zip(*linhas)
+            dados_agrupados[ticker] = {'datas': list(datas), 'precos': list(precos)}
         
-        return metricas
+        return app.json.dumps(dados_agrupados)
     
     @staticmethod
     def gerar_oportunidades(id_segmento):
         """Gera oportunidades de investimento baseado em análise"""
         metricas = AnalisadorInvestimentos.calcular_metricas_segmento(id_segmento)
+        return analise.gerar_oportunidades(id_segmento, metricas)
+    
+    @staticmethod
+    def obter_oportunidades_salvas(id_segmento):
+        """Retorna a análise mais recente gravada para o segmento"""
+        opp = db.session.query(OportunidadesInvestimento).filter_by(
+            IdSegmento=id_segmento, Ativo=True
+        ).order_by(desc(OportunidadesInvestimento.DataAnalise)).first()
         
-        if not metricas:
+        if not opp:
             return []
         
-        oportunidades = []
-        
-        # Análise simplista de oportunidades
-        retorno_medio = metricas['RetornoMedio']
-        volatilidade = metricas['VolatilidadeMedia']
-        
-        # Determine tipo de oportunidade baseado em volatilidade e retorno
-        if retorno_medio > 2:
-            tipo = 'COMPRA'
-            potencial = retorno_medio * 1.5
-        elif retorno_medio < -1:
-            tipo = 'VENDA'
-            potencial = abs(retorno_medio) * 0.8
-        else:
-            tipo = 'HOLD'
-            potencial = retorno_medio
-        
-        # Nível de risco baseado em volatilidade
-        if volatilidade < 2:
-            risco = 'BAIXO'
-            confianca = 0.85
-        elif volatilidade < 5:
-            risco = 'MEDIO'
-            confianca = 0.70
-        else:
-            risco = 'ALTO'
-            confianca = 0.55
-        
-        oportunidade = {
-            'id_segmento': id_segmento,
-            'titulo': f'Oportunidade em Segmento',
-            'descricao': f'Análise baseada em {365} dias de dados históricos',
-            'tipo': tipo,
-            'potencial_retorno': float(potencial),
-            'nivel_risco': risco,
-            'confianca': float(confianca),
-            'metricas': metricas
-        }
-        
-        oportunidades.append(oportunidade)
-        return oportunidades
+        return [{
+            'id_segmento': opp.IdSegmento,
+            'titulo': opp.Titulo,
+            'descricao': opp.Descricao,
+            'tipo': opp.TipoOportunidade,
+            'potencial_retorno': opp.PotencialRetorno or 0,
+            'nivel_risco': opp.NivelRisco,
+            'confianca': opp.Confianca or 0
+        }]
 
 # =====================================================
 # ROTAS DA APLICAÇÃO
@@ -214,7 +218,11 @@ class AnalisadorInvestimentos:
 def index():
     """Página inicial com lista de segmentos"""
     try:
-        segmentos = db.session.query(SegmentosInvestimento).filter_by(Ativo=True).all()
+        segmentos = db.session.query(SegmentosInvestimento).with_entities(
+            SegmentosInvestimento.IdSegmento,
+            SegmentosInvestimento.Nome,
+            SegmentosInvestimento.Descricao
+        ).filter_by(Ativo=True).all()
         return render_template('index.html', segmentos=segmentos)
     except Exception as e:
         logger.error(f"Erro ao carregar página inicial: {e}")
@@ -224,13 +232,12 @@ def index():
 def api_segmentos():
     """API: Lista todos os segmentos"""
     try:
-        segmentos = db.session.query(SegmentosInvestimento).filter_by(Ativo=True).all()
+        segmentos = db.session.execute(_Q_SEGMENTOS_TOTAL_INDICES).all()
         return jsonify([{
             'id': seg.IdSegmento,
             'nome': seg.Nome,
             'descricao': seg.Descricao,
-            'total_indices': len(db.session.query(IndicesSegmentos)
-                                .filter_by(IdSegmento=seg.IdSegmento).all())
+            'total_indices': seg.TotalIndices
         } for seg in segmentos])
     except Exception as e:
         logger.error(f"Erro ao buscar segmentos: {e}")
@@ -240,21 +247,14 @@ def api_segmentos():
 def detalhes_segmento(id_segmento):
     """Página de detalhes de um segmento"""
     try:
-        segmento = db.session.query(SegmentosInvestimento).get(id_segmento)
+        segmento = db.session.get(SegmentosInvestimento, id_segmento)
         if not segmento:
             return render_template('error.html', erro='Segmento não encontrado'), 404
         
-        indices = db.session.execute(text('''
-            SELECT i.IdIndice, i.Ticker, i.Descricao, COUNT(hp.IdHistorico) as TotalRegistros
-            FROM Indices i
-            LEFT JOIN HistoricoPrecos hp ON i.IdIndice = hp.IdIndice
-            INNER JOIN IndicesSegmentos seg ON i.IdIndice = seg.IdIndice
-            WHERE seg.IdSegmento = :id_segmento
-            GROUP BY i.IdIndice, i.Ticker, i.Descricao
-        '''), {'id_segmento': id_segmento}).fetchall()
+        indices = db.session.execute(_Q_INDICES_SEGMENTO, {'id_segmento': id_segmento}).fetchall()
         
         metricas = AnalisadorInvestimentos.calcular_metricas_segmento(id_segmento)
-        oportunidades = AnalisadorInvestimentos.gerar_oportunidades(id_segmento)
+        oportunidades = AnalisadorInvestimentos.obter_oportunidades_salvas(id_segmento)
         
         return render_template('detalhes_segmento.html',
                              segmento=segmento,
@@ -270,19 +270,15 @@ def api_grafico_segmento(id_segmento):
     """API: Retorna dados para gráfico de um segmento"""
     try:
         dias = request.args.get('dias', 90, type=int)
-        dados = AnalisadorInvestimentos.obter_dados_segmento(id_segmento, dias=dias)
         
-        # Agrupar por ticker
-        dados_agrupados = {}
-        for row in dados:
-            ticker = row[0]
-            if ticker not in dados_agrupados:
-                dados_agrupados[ticker] = {'datas': [], 'precos': []}
-            
-            dados_agrupados[ticker]['datas'].append(str(row[2]))
-            dados_agrupados[ticker]['precos'].append(float(row[3]) if row[3] else 0)
+        # Normalizar o período para um conjunto fixo, para que valores próximos compartilhem o cache
+        dias = min(max(dias, 1), PERIODOS_GRAFICO[-1])
+        dias = next(periodo for periodo in PERIODOS_GRAFICO if dias <= periodo)
         
-        return jsonify(dados_agrupados)
+        return app.response_class(
+            AnalisadorInvestimentos.obter_grafico_segmento(id_segmento, dias),
+            mimetype='application/json'
+        )
     except Exception as e:
         logger.error(f"Erro ao gerar gráfico: {e}")
         return jsonify({'erro': str(e)}), 500
@@ -298,30 +294,43 @@ def api_oportunidades():
         if id_segmento:
             query = query.filter_by(IdSegmento=id_segmento)
         
-        oportunidades = query.order_by(desc(OportunidadesInvestimento.DataAnalise)).all()
+        # Colunas já rotuladas com as chaves do JSON e numéricos vindos como float
+        oportunidades = query.with_entities(
+            OportunidadesInvestimento.IdOportunidade.label('id'),
+            OportunidadesInvestimento.Titulo.label('titulo'),
+            OportunidadesInvestimento.Descricao.label('descricao'),
+            OportunidadesInvestimento.TipoOportunidade.label('tipo'),
+            func.coalesce(OportunidadesInvestimento.PotencialRetorno, 0).label('potencial_retorno'),
+            OportunidadesInvestimento.NivelRisco.label('nivel_risco'),
+            func.coalesce(OportunidadesInvestimento.Confianca, 0).label('confianca')
+        ).order_by(desc(OportunidadesInvestimento.DataAnalise)).all()
         
-        return jsonify([{
-            'id': opp.IdOportunidade,
-            'titulo': opp.Titulo,
-            'descricao': opp.Descricao,
-            'tipo': opp.TipoOportunidade,
-            'potencial_retorno': float(opp.PotencialRetorno) if opp.PotencialRetorno else 0,
-            'nivel_risco': opp.NivelRisco,
-            'confianca': float(opp.Confianca) if opp.Confianca else 0
-        } for opp in oportunidades])
+        return jsonify([opp._asdict() for opp in oportunidades])
     except Exception as e:
         logger.error(f"Erro ao buscar oportunidades: {e}")
         return jsonify({'erro': str(e)}), 500
 
+def _metricas_em_contexto(id_segmento):
+    """Calcula as métricas em uma thread auxiliar, com contexto e sessão próprios"""
+    with app.app_context():
+        return AnalisadorInvestimentos.calcular_metricas_segmento(id_segmento)
+
 @app.route('/dashboard')
 def dashboard():
     """Dashboard com visão geral de todos os segmentos"""
     try:
-        segmentos = db.session.query(SegmentosInvestimento).filter_by(Ativo=True).all()
+        segmentos = db.session.query(SegmentosInvestimento).with_entities(
+            SegmentosInvestimento.IdSegmento,
+            SegmentosInvestimento.Nome
+        ).filter_by(Ativo=True).all()
+        
+        # Consultas por segmento são limitadas por I/O: sobrepô-las no pool de conexões
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            resultados = list(executor.map(_metricas_em_contexto,
+                                           [seg.IdSegmento for seg in segmentos]))
         
         dashboard_data = []
-        for seg in segmentos:
-            metricas = AnalisadorInvestimentos.calcular_metricas_segmento(seg.IdSegmento)
+        for seg, metricas in zip(segmentos, resultados):
             if metricas:
                 dashboard_data.append({
                     'segmento': seg.Nome,
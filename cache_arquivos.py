@@ -0,0 +1,94 @@
+import json
+import os
+import time
+from datetime import date
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# CACHE EM DISCO PARA DOWNLOADS DO YAHOO FINANCE
+# =====================================================
+class FileCache:
+    """
+    Cache de DataFrames em arquivos parquet, um por ticker.
+    
+    Cada ticker guarda o histórico acumulado e o intervalo [início, fim) já
+    baixado; qualquer período contido nesse intervalo é servido por fatia de data.
+    """
+    
+    def __init__(self, diretorio='.cache', ttl_segundos=24 * 3600):
+        """
+        Args:
+            diretorio: Pasta raiz do cache
+            ttl_segundos: Validade dos dados quando o período pedido inclui o dia de hoje
+        """
+        self.diretorio = diretorio
+        self.ttl_segundos = ttl_segundos
+    
+    def _caminhos(self, ticker):
+        """Retorna (arquivo de dados, arquivo com o intervalo coberto) do ticker"""
+        base = os.path.join(self.diretorio, ticker.replace('^', '_'))
+        return f"{base}.parquet", f"{base}.json"
+    
+    def _periodo_aberto(self, end):
+        """Indica se o período ainda pode receber pregões novos (chega até hoje)"""
+        return end is None or pd.Timestamp(end).date() >= date.today()
+    
+    def _ler(self, ticker):
+        """Retorna (DataFrame, início, fim) gravados para o ticker, ou None"""
+        caminho_dados, caminho_intervalo = self._caminhos(ticker)
+        if not (os.path.exists(caminho_dados) and os.path.exists(caminho_intervalo)):
+            return None
+        
+        try:
+            with open(caminho_intervalo, encoding='utf-8') as f:
+                intervalo = json.load(f)
+            df = pd.read_parquet(caminho_dados)
+        except Exception as e:
+            logger.warning(f"⚠ Cache corrompido para {ticker}, ignorando: {e}")
+            return None
+        
+        return df, pd.Timestamp(intervalo['inicio']), pd.Timestamp(intervalo['fim'])
+    
+    def obter(self, ticker, start, end):
+        """Retorna a fatia [start, end) em cache ou None se não coberta/expirada"""
+        gravado = self._ler(ticker)
+        if gravado is None:
+            return None
+        
+        df, inicio, fim = gravado
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if start < inicio or end > fim:
+            return None
+        
+        # Pregões passados não mudam: só expira o pedido que inclui o dia corrente
+        caminho_dados, _ = self._caminhos(ticker)
+        if self._periodo_aberto(end) and time.time() - os.path.getmtime(caminho_dados) > self.ttl_segundos:
+            return None
+        
+        fatia = df[(df.index >= start) & (df.index < end)]
+        return fatia if not fatia.empty else None
+    
+    def salvar(self, ticker, start, end, df):
+        """Grava o período baixado, acumulando-o ao histórico já em cache quando contíguo"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        
+        gravado = self._ler(ticker)
+        if gravado is not None:
+            df_antigo, inicio, fim = gravado
+            if start <= fim and end >= inicio:
+                df = pd.concat([df_antigo, df])
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+                start, end = min(start, inicio), max(end, fim)
+        
+        caminho_dados, caminho_intervalo = self._caminhos(ticker)
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            df.to_parquet(caminho_dados)
+            with open(caminho_intervalo, 'w', encoding='utf-8') as f:
+                json.dump({'inicio': start.isoformat(), 'fim': end.isoformat()}, f)
+        except Exception as e:
+            logger.warning(f"⚠ Não foi possível gravar cache de {ticker}: {e}")
@@ -1,10 +1,13 @@
 import yfinance as yf
 import pandas as pd
-from datetime import datetime, timedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 import logging
-from typing import List, Dict
-import time
+from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
+
+import analise
+from limitador_taxa import limitador_yahoo
+from lote_yahoo import baixar_lote_limitado
 
 # Configuração de logging
 logging.basicConfig(
@@ -13,6 +16,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _valores_sql(serie: pd.Series) -> list:
+    """Converte uma coluna numérica em lista de valores nativos (NaN -> NULL)"""
+    if serie.hasnans:
+        return serie.astype(object).where(serie.notna(), None).tolist()
+    return serie.tolist()
+
+@lru_cache(maxsize=None)
+def obter_ticker(ticker: str) -> yf.Ticker:
+    """Retorna o objeto yf.Ticker do símbolo, reaproveitado entre chamadas"""
+    return yf.Ticker(ticker)
+
 class YahooFinanceCollector:
     """Coletor de dados do Yahoo Finance"""
     
@@ -23,9 +37,60 @@ class YahooFinanceCollector:
         Args:
             connection_string: String de conexão do SQL Server
         """
-        self.engine = create_engine(connection_string)
+        # fast_executemany faz o pyodbc enviar os lotes de parâmetros em uma
+        # única ida ao servidor em vez de um round-trip por linha
+        self.engine = create_engine(connection_string, fast_executemany=True)
         self.connection_string = connection_string
         
+    def garantir_indices_performance(self):
+        """
+        Cria (se ainda não existirem) os índices de cobertura usados pelas análises
+        e remove o índice legado substituído por eles
+        """
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("""
+                    IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                                   WHERE name = 'IX_HistoricoPrecos_Indice_Data'
+                                   AND object_id = OBJECT_ID('HistoricoPrecos'))
+                        CREATE NONCLUSTERED INDEX IX_HistoricoPrecos_Indice_Data
+                        ON HistoricoPrecos(IdIndice, DataQuotacao)
+                        INCLUDE (Fechamento, FechamentoAjustado, Volume, Alta, Baixa)
+                        WITH (DATA_COMPRESSION = PAGE);
+                    ELSE IF EXISTS (SELECT 1 FROM sys.indexes i
+                                    JOIN sys.partitions p
+                                      ON p.object_id = i.object_id AND p.index_id = i.index_id
+                                    WHERE i.name = 'IX_HistoricoPrecos_Indice_Data'
+                                    AND i.object_id = OBJECT_ID('HistoricoPrecos')
+                                    AND (i.is_unique = 1 OR p.data_compression_desc <> 'PAGE'))
+                        -- UQ_HistoricoPrecos já garante a unicidade; este índice só cobre as leituras
+                        CREATE NONCLUSTERED INDEX IX_HistoricoPrecos_Indice_Data
+                        ON HistoricoPrecos(IdIndice, DataQuotacao)
+                        INCLUDE (Fechamento, FechamentoAjustado, Volume, Alta, Baixa)
+                        WITH (DATA_COMPRESSION = PAGE, DROP_EXISTING = ON);
+                    
+                    IF EXISTS (SELECT 1 FROM sys.indexes
+                               WHERE name = 'IX_HistoricoPrecos_IdIndice'
+                               AND object_id = OBJECT_ID('HistoricoPrecos'))
+                        DROP INDEX IX_HistoricoPrecos_IdIndice ON HistoricoPrecos;
+                    
+                    IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                                   WHERE name = 'IX_IndicesSegmentos_Seg'
+                                   AND object_id = OBJECT_ID('IndicesSegmentos'))
+                        CREATE INDEX IX_IndicesSegmentos_Seg
+                        ON IndicesSegmentos(IdSegmento) INCLUDE (IdIndice);
+                    
+                    IF EXISTS (SELECT 1 FROM sys.indexes
+                               WHERE name = 'IX_IndicesSegmentos_IdSegmento'
+                               AND object_id = OBJECT_ID('IndicesSegmentos'))
+                        DROP INDEX IX_IndicesSegmentos_IdSegmento ON IndicesSegmentos;
+                """))
+                conn.commit()
+                logger.info("✓ Índices de performance verificados")
+                
+        except Exception as e:
+            logger.warning(f"⚠ Não foi possível criar os índices de performance: {e}")
+    
     def adicionar_indice(self, ticker: str, descricao: str, pais: str) -> int:
         """
         Adiciona um novo índice ao banco de dados
@@ -40,33 +105,31 @@ class YahooFinanceCollector:
         """
         try:
             with self.engine.connect() as conn:
-                # Verificar se já existe
+                # Upsert em um único round-trip; o UPDATE sem efeito garante o OUTPUT
+                # do ID também quando o índice já existe
                 query = text("""
-                    SELECT IdIndice FROM Indices WHERE Ticker = :ticker
-                """)
-                result = conn.execute(query, {'ticker': ticker}).fetchone()
-                
-                if result:
-                    logger.info(f"✓ Índice {ticker} já existe (ID: {result[0]})")
-                    return result[0]
-                
-                # Inserir novo índice
-                insert_query = text("""
-                    INSERT INTO Indices (Ticker, Descricao, Pais, DataCriacao, Ativo)
-                    OUTPUT INSERTED.IdIndice
-                    VALUES (:ticker, :descricao, :pais, :data_criacao, 1)
+                    MERGE Indices WITH (HOLDLOCK) AS t
+                    USING (VALUES (:ticker, :descricao, :pais)) AS s (Ticker, Descricao, Pais)
+                    ON t.Ticker = s.Ticker
+                    WHEN MATCHED THEN
+                        UPDATE SET t.Ticker = s.Ticker
+                    WHEN NOT MATCHED THEN
+                        INSERT (Ticker, Descricao, Pais, Ativo)
+                        VALUES (s.Ticker, s.Descricao, s.Pais, 1)
+                    OUTPUT inserted.IdIndice, $action;
                 """)
                 
-                result = conn.execute(insert_query, {
+                id_indice, acao = conn.execute(query, {
                     'ticker': ticker,
                     'descricao': descricao,
-                    'pais': pais,
-                    'data_criacao': datetime.now()
-                })
+                    'pais': pais
+                }).fetchone()
                 conn.commit()
                 
-                id_indice = result.fetchone()[0]
-                logger.info(f"✓ Índice {ticker} adicionado (ID: {id_indice})")
+                if acao == 'INSERT':
+                    logger.info(f"✓ Índice {ticker} adicionado (ID: {id_indice})")
+                else:
+                    logger.info(f"✓ Índice {ticker} já existe (ID: {id_indice})")
                 return id_indice
                 
         except Exception as e:
@@ -88,7 +151,8 @@ class YahooFinanceCollector:
             logger.info(f"⬇ Baixando dados de {ticker} (período: {periodo})...")
             
             # Baixar dados do Yahoo Finance
-            stock = yf.Ticker(ticker)
+            stock = obter_ticker(ticker)
+            limitador_yahoo.adquirir()
             df = stock.history(period=periodo)
             
             if df.empty:
@@ -105,6 +169,47 @@ class YahooFinanceCollector:
             logger.error(f"✗ Erro ao baixar dados de {ticker}: {e}")
             return pd.DataFrame()
     
+    def baixar_lote(self, tickers: List[str], periodo: str = "2y") -> Dict[str, pd.DataFrame]:
+        """
+        Baixa dados históricos de vários tickers em lote (yf.download paralelo,
+        em grupos limitados pelo limitador_yahoo)
+        
+        Args:
+            tickers: Lista de símbolos
+            periodo: Período dos dados (1mo, 3mo, 6mo, 1y, 2y, 5y, 10y, max)
+            
+        Returns:
+            Dicionário ticker -> DataFrame com os dados históricos
+        """
+        dados = {}
+        
+        try:
+            logger.info(f"⬇ Baixando dados de {len(tickers)} tickers (período: {periodo})...")
+            
+            frames = baixar_lote_limitado(
+                tickers,
+                period=periodo,
+                auto_adjust=True  # mesmo padrão de Ticker.history(): preços ajustados
+            )
+            
+        except Exception as e:
+            logger.error(f"✗ Erro ao baixar lote de dados: {e}")
+            return {ticker: pd.DataFrame() for ticker in tickers}
+        
+        
+        for ticker in tickers:
+            df = frames.get(ticker)
+            if df is None or df.empty:
+                logger.warning(f"⚠ Nenhum dado encontrado para {ticker}")
+                dados[ticker] = pd.DataFrame()
+                continue
+            
+            df = df.reset_index()
+            logger.info(f"✓ {len(df)} registros baixados para {ticker}")
+            dados[ticker] = df
+        
+        return dados
+    
     def salvar_historico_precos(self, id_indice: int, ticker: str, df: pd.DataFrame):
         """
         Salva dados históricos no banco de dados
@@ -113,67 +218,72 @@ class YahooFinanceCollector:
             id_indice: ID do índice
             ticker: Símbolo do ticker
             df: DataFrame com os dados
+            
+        Returns:
+            Quantidade de registros novos gravados
         """
         if df.empty:
             logger.warning(f"⚠ Nenhum dado para salvar de {ticker}")
-            return
+            return 0
+        
+        # Uma linha por data: repetidas no lote violariam UQ_HistoricoPrecos no MERGE
+        datas = df['Date'].dt.date
+        unicos = ~datas.duplicated(keep='last').to_numpy()
+        datas = datas[unicos]
+        fechamento_ajustado = df['Adj Close'] if 'Adj Close' in df.columns else df['Close']
+        
+        # Colunas enviadas direto como listas posicionais (sem DataFrame/dict intermediário)
+        colunas = [
+            [id_indice] * len(datas),
+            datas.tolist(),
+            _valores_sql(df['Open'][unicos]),
+            _valores_sql(df['High'][unicos]),
+            _valores_sql(df['Low'][unicos]),
+            _valores_sql(df['Close'][unicos]),
+            _valores_sql(fechamento_ajustado[unicos]),
+            df['Volume'][unicos].fillna(0).astype('int64').tolist()
+        ]
         
         try:
             with self.engine.connect() as conn:
-                # Limpar dados antigos (opcional - remova se quiser manter histórico)
-                # delete_query = text("DELETE FROM HistoricoPrecos WHERE IdIndice = :id_indice")
-                # conn.execute(delete_query, {'id_indice': id_indice})
+                conn.exec_driver_sql("""
+                    IF OBJECT_ID('tempdb..#tmpHP') IS NOT NULL
+                        DROP TABLE #tmpHP;
+                    
+                    CREATE TABLE #tmpHP (
+                        IdIndice INT,
+                        DataQuotacao DATE,
+                        Abertura FLOAT,
+                        Alta FLOAT,
+                        Baixa FLOAT,
+                        Fechamento FLOAT,
+                        FechamentoAjustado FLOAT,
+                        Volume BIGINT
+                    )
+                """)
                 
-                registros_inseridos = 0
-                registros_duplicados = 0
+                # executemany com fast_executemany no staging
+                conn.exec_driver_sql(
+                    "INSERT INTO #tmpHP VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    list(zip(*colunas))
+                )
                 
-                for _, row in df.iterrows():
-                    try:
-                        # Verificar se já existe
-                        check_query = text("""
-                            SELECT COUNT(*) FROM HistoricoPrecos 
-                            WHERE IdIndice = :id_indice AND DataQuotacao = :data
-                        """)
-                        
-                        existe = conn.execute(check_query, {
-                            'id_indice': id_indice,
-                            'data': row['Date'].date()
-                        }).fetchone()[0]
-                        
-                        if existe > 0:
-                            registros_duplicados += 1
-                            continue
-                        
-                        # Inserir registro
-                        insert_query = text("""
-                            INSERT INTO HistoricoPrecos (
-                                IdIndice, DataQuotacao, Abertura, Alta, Baixa, 
-                                Fechamento, FechamentoAjustado, Volume, DataInsercao
-                            ) VALUES (
-                                :id_indice, :data_quotacao, :abertura, :alta, :baixa,
-                                :fechamento, :fechamento_ajustado, :volume, :data_insercao
-                            )
-                        """)
-                        
-                        conn.execute(insert_query, {
-                            'id_indice': id_indice,
-                            'data_quotacao': row['Date'].date(),
-                            'abertura': float(row['Open']) if pd.notna(row['Open']) else None,
-                            'alta': float(row['High']) if pd.notna(row['High']) else None,
-                            'baixa': float(row['Low']) if pd.notna(row['Low']) else None,
-                            'fechamento': float(row['Close']) if pd.notna(row['Close']) else None,
-                            'fechamento_ajustado': float(row['Close']) if pd.notna(row['Close']) else None,
-                            'volume': int(row['Volume']) if pd.notna(row['Volume']) else 0,
-                            'data_insercao': datetime.now()
-                        })
-                        
-                        registros_inseridos += 1
-                        
-                    except Exception as e:
-                        logger.error(f"✗ Erro ao inserir registro: {e}")
-                        continue
+                # Anti-duplicado atômico contra o que já está gravado (inclusive pelo loader)
+                registros_inseridos = conn.exec_driver_sql("""
+                    MERGE HistoricoPrecos WITH (HOLDLOCK) AS tgt
+                    USING #tmpHP AS src
+                    ON tgt.IdIndice = src.IdIndice AND tgt.DataQuotacao = src.DataQuotacao
+                    WHEN NOT MATCHED THEN
+                        INSERT (IdIndice, DataQuotacao, Abertura, Alta, Baixa,
+                                Fechamento, FechamentoAjustado, Volume)
+                        VALUES (src.IdIndice, src.DataQuotacao, src.Abertura, src.Alta, src.Baixa,
+                                src.Fechamento, src.FechamentoAjustado, src.Volume);
+                """).rowcount
+                registros_duplicados = len(df) - registros_inseridos
                 
+                conn.exec_driver_sql("DROP TABLE #tmpHP")
                 conn.commit()
+                
                 logger.info(f"✓ {registros_inseridos} novos registros inseridos para {ticker}")
                 if registros_duplicados > 0:
                     logger.info(f"⚠ {registros_duplicados} registros duplicados ignorados")
@@ -181,8 +291,11 @@ class YahooFinanceCollector:
         except Exception as e:
             logger.error(f"✗ Erro ao salvar histórico de {ticker}: {e}")
             raise
+        
+        return registros_inseridos
     
-    def coletar_indice_completo(self, ticker: str, descricao: str, pais: str, periodo: str = "2y"):
+    def coletar_indice_completo(self, ticker: str, descricao: str, pais: str, periodo: str = "2y",
+                                df: Optional[pd.DataFrame] = None):
         """
         Processo completo: adiciona índice e coleta dados históricos
         
@@ -191,6 +304,10 @@ class YahooFinanceCollector:
             descricao: Descrição do índice
             pais: País de origem
             periodo: Período dos dados
+            df: Dados já baixados (ex: por baixar_lote); se omitido, baixa o ticker
+            
+        Returns:
+            Quantidade de registros novos gravados
         """
         try:
             logger.info(f"\n{'='*60}")
@@ -200,18 +317,22 @@ class YahooFinanceCollector:
             # 1. Adicionar/obter índice
             id_indice = self.adicionar_indice(ticker, descricao, pais)
             
-            # 2. Baixar dados do Yahoo Finance
-            df = self.baixar_dados_historicos(ticker, periodo)
+            # 2. Baixar dados do Yahoo Finance (se ainda não baixados em lote)
+            if df is None:
+                df = self.baixar_dados_historicos(ticker, periodo)
             
             # 3. Salvar no banco de dados
             if not df.empty:
-                self.salvar_historico_precos(id_indice, ticker, df)
+                registros_inseridos = self.salvar_historico_precos(id_indice, ticker, df)
                 logger.info(f"✓ Coleta concluída com sucesso para {ticker}\n")
+                return registros_inseridos
             else:
                 logger.warning(f"⚠ Nenhum dado coletado para {ticker}\n")
                 
         except Exception as e:
             logger.error(f"✗ Erro na coleta de {ticker}: {e}\n")
+        
+        return 0
     
     def criar_segmento(self, nome: str, descricao: str) -> int:
         """
@@ -226,36 +347,76 @@ class YahooFinanceCollector:
         """
         try:
             with self.engine.connect() as conn:
-                # Verificar se já existe
-                query = text("SELECT IdSegmento FROM SegmentosInvestimento WHERE Nome = :nome")
-                result = conn.execute(query, {'nome': nome}).fetchone()
-                
-                if result:
-                    logger.info(f"✓ Segmento '{nome}' já existe (ID: {result[0]})")
-                    return result[0]
-                
-                # Inserir novo segmento
-                insert_query = text("""
-                    INSERT INTO SegmentosInvestimento (Nome, Descricao, DataCriacao, Ativo)
-                    OUTPUT INSERTED.IdSegmento
-                    VALUES (:nome, :descricao, :data_criacao, 1)
+                # Upsert em um único round-trip (ver adicionar_indice)
+                query = text("""
+                    MERGE SegmentosInvestimento WITH (HOLDLOCK) AS t
+                    USING (VALUES (:nome, :descricao)) AS s (Nome, Descricao)
+                    ON t.Nome = s.Nome
+                    WHEN MATCHED THEN
+                        UPDATE SET t.Nome = s.Nome
+                    WHEN NOT MATCHED THEN
+                        INSERT (Nome, Descricao, Ativo)
+                        VALUES (s.Nome, s.Descricao, 1)
+                    OUTPUT inserted.IdSegmento, $action;
                 """)
                 
-                result = conn.execute(insert_query, {
+                id_segmento, acao = conn.execute(query, {
                     'nome': nome,
-                    'descricao': descricao,
-                    'data_criacao': datetime.now()
-                })
+                    'descricao': descricao
+                }).fetchone()
                 conn.commit()
                 
-                id_segmento = result.fetchone()[0]
-                logger.info(f"✓ Segmento '{nome}' criado (ID: {id_segmento})")
+                if acao == 'INSERT':
+                    logger.info(f"✓ Segmento '{nome}' criado (ID: {id_segmento})")
+                else:
+                    logger.info(f"✓ Segmento '{nome}' já existe (ID: {id_segmento})")
                 return id_segmento
                 
         except Exception as e:
             logger.error(f"✗ Erro ao criar segmento '{nome}': {e}")
             raise
     
+    def criar_segmentos(self, segmentos_info: Dict[str, str]) -> Dict[str, int]:
+        """
+        Cria em lote os segmentos que ainda não existem
+        
+        Args:
+            segmentos_info: Dicionário nome -> descrição
+            
+        Returns:
+            Dicionário nome -> ID do segmento
+        """
+        try:
+            with self.engine.connect() as conn:
+                # Um único MERGE sobre uma tabela VALUES; o UPDATE sem efeito faz o
+                # OUTPUT devolver também o ID dos segmentos que já existiam
+                valores = ", ".join(f"(:nome{i}, :descricao{i})" for i in range(len(segmentos_info)))
+                params = {}
+                for i, (nome, descricao) in enumerate(segmentos_info.items()):
+                    params[f'nome{i}'] = nome
+                    params[f'descricao{i}'] = descricao
+                
+                resultado = conn.execute(text(f"""
+                    MERGE SegmentosInvestimento WITH (HOLDLOCK) AS t
+                    USING (VALUES {valores}) AS s (Nome, Descricao)
+                    ON t.Nome = s.Nome
+                    WHEN MATCHED THEN
+                        UPDATE SET t.Nome = t.Nome
+                    WHEN NOT MATCHED THEN
+                        INSERT (Nome, Descricao, Ativo)
+                        VALUES (s.Nome, s.Descricao, 1)
+                    OUTPUT inserted.Nome, inserted.IdSegmento;
+                """), params)
+                segmentos_ids = dict(resultado.all())
+                conn.commit()
+                
+                logger.info(f"✓ {len(segmentos_ids)} segmentos disponíveis")
+                return segmentos_ids
+                
+        except Exception as e:
+            logger.error(f"✗ Erro ao criar segmentos: {e}")
+            raise
+    
     def associar_indice_segmento(self, ticker: str, id_segmento: int, peso: float = 100.0):
         """
         Associa um índice a um segmento
@@ -267,49 +428,153 @@ class YahooFinanceCollector:
         """
         try:
             with self.engine.connect() as conn:
-                # Obter ID do índice
-                query = text("SELECT IdIndice FROM Indices WHERE Ticker = :ticker")
-                result = conn.execute(query, {'ticker': ticker}).fetchone()
-                
-                if not result:
-                    logger.error(f"✗ Índice {ticker} não encontrado")
-                    return
-                
-                id_indice = result[0]
-                
-                # Verificar se já existe associação
-                check_query = text("""
-                    SELECT COUNT(*) FROM IndicesSegmentos 
-                    WHERE IdIndice = :id_indice AND IdSegmento = :id_segmento
+                # Resolve o ID do índice e insere a associação em um único comando
+                query = text("""
+                    MERGE IndicesSegmentos WITH (HOLDLOCK) AS t
+                    USING (
+                        SELECT i.IdIndice, :id_segmento AS IdSegmento
+                        FROM Indices i
+                        WHERE i.Ticker = :ticker
+                    ) AS s
+                    ON t.IdIndice = s.IdIndice AND t.IdSegmento = s.IdSegmento
+                    WHEN MATCHED THEN
+                        UPDATE SET t.Peso = t.Peso
+                    WHEN NOT MATCHED THEN
+                        INSERT (IdIndice, IdSegmento, Peso)
+                        VALUES (s.IdIndice, s.IdSegmento, :peso)
+                    OUTPUT $action;
                 """)
                 
-                existe = conn.execute(check_query, {
-                    'id_indice': id_indice,
-                    'id_segmento': id_segmento
-                }).fetchone()[0]
+                result = conn.execute(query, {
+                    'ticker': ticker,
+                    'id_segmento': id_segmento,
+                    'peso': peso
+                }).fetchone()
+                conn.commit()
                 
-                if existe > 0:
+                if not result:
+                    logger.error(f"✗ Índice {ticker} não encontrado")
+                elif result[0] == 'INSERT':
+                    logger.info(f"✓ Índice {ticker} associado ao segmento")
+                else:
                     logger.info(f"⚠ Índice {ticker} já associado ao segmento")
-                    return
                 
-                # Inserir associação
-                insert_query = text("""
-                    INSERT INTO IndicesSegmentos (IdIndice, IdSegmento, Peso, DataCriacao)
-                    VALUES (:id_indice, :id_segmento, :peso, :data_criacao)
-                """)
+        except Exception as e:
+            logger.error(f"✗ Erro ao associar índice {ticker}: {e}")
+    
+    def associar_indices_segmento(self, pares: List[Tuple[str, int, float]]):
+        """
+        Associa vários índices a segmentos em lote
+        
+        Args:
+            pares: Lista de tuplas (ticker, id_segmento, peso)
+        """
+        if not pares:
+            return
+        
+        try:
+            with self.engine.connect() as conn:
+                # Resolver todos os IDs de índice em uma consulta
+                query = text("""
+                    SELECT Ticker, IdIndice FROM Indices WHERE Ticker IN :tickers
+                """).bindparams(bindparam('tickers', expanding=True))
+                ids_indices = dict(conn.execute(query, {
+                    'tickers': list({ticker for ticker, _, _ in pares})
+                }).all())
                 
-                conn.execute(insert_query, {
-                    'id_indice': id_indice,
-                    'id_segmento': id_segmento,
-                    'peso': peso,
-                    'data_criacao': datetime.now()
-                })
+                parametros = []
+                for ticker, id_segmento, peso in pares:
+                    id_indice = ids_indices.get(ticker)
+                    if id_indice is None:
+                        logger.error(f"✗ Índice {ticker} não encontrado")
+                        continue
+                    parametros.append({
+                        'id_indice': id_indice,
+                        'id_segmento': id_segmento,
+                        'peso': peso
+                    })
+                
+                # Um executemany (fast_executemany) para todas as associações
+                if parametros:
+                    conn.execute(text("""
+                        MERGE IndicesSegmentos WITH (HOLDLOCK) AS t
+                        USING (VALUES (:id_indice, :id_segmento, :peso)) AS s (IdIndice, IdSegmento, Peso)
+                        ON t.IdIndice = s.IdIndice AND t.IdSegmento = s.IdSegmento
+                        WHEN NOT MATCHED THEN
+                            INSERT (IdIndice, IdSegmento, Peso)
+                            VALUES (s.IdIndice, s.IdSegmento, s.Peso);
+                    """), parametros)
                 conn.commit()
                 
-                logger.info(f"✓ Índice {ticker} associado ao segmento")
+                logger.info(f"✓ {len(parametros)} associações índice/segmento verificadas")
                 
         except Exception as e:
-            logger.error(f"✗ Erro ao associar índice {ticker}: {e}")
+            logger.error(f"✗ Erro ao associar índices aos segmentos: {e}")
+    
+    def segmentos_dos_tickers(self, tickers: List[str]) -> List[int]:
+        """
+        Retorna os segmentos aos quais os tickers estão associados
+        
+        Args:
+            tickers: Símbolos dos tickers
+        """
+        if not tickers:
+            return []
+        
+        query = text("""
+            SELECT DISTINCT seg.IdSegmento
+            FROM IndicesSegmentos seg
+            INNER JOIN Indices i ON i.IdIndice = seg.IdIndice
+            WHERE i.Ticker IN :tickers
+        """).bindparams(bindparam('tickers', expanding=True))
+        
+        with self.engine.connect() as conn:
+            return conn.execute(query, {'tickers': list(tickers)}).scalars().all()
+    
+    def atualizar_oportunidades(self, ids_segmentos: List[int]):
+        """
+        Recalcula e grava as oportunidades dos segmentos, para que a aplicação
+        web apenas leia a análise pronta
+        
+        Args:
+            ids_segmentos: IDs dos segmentos a atualizar
+        """
+        with self.engine.connect() as conn:
+            for id_segmento in ids_segmentos:
+                try:
+                    total = analise.salvar_oportunidades(conn, id_segmento)
+                    conn.commit()
+                    logger.info(f"✓ {total} oportunidade(s) gravada(s) para o segmento {id_segmento}")
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"✗ Erro ao gravar oportunidades do segmento {id_segmento}: {e}")
+
+    def invalidar_cache_segmentos(self, ids_segmentos: List[int]):
+        """
+        Remove do cache da aplicação web as métricas dos segmentos atualizados e
+        já deixa pronto (recalculado) o JSON dos gráficos de cada período
+        
+        Args:
+            ids_segmentos: IDs dos segmentos que receberam dados novos
+        """
+        if not ids_segmentos:
+            return
+        
+        # Import tardio: só o cache (FileSystemCache compartilhado) é usado aqui
+        from app import app, cache, AnalisadorInvestimentos, PERIODOS_GRAFICO
+        
+        try:
+            with app.app_context():
+                for id_segmento in ids_segmentos:
+                    cache.delete_memoized(AnalisadorInvestimentos.calcular_metricas_segmento, id_segmento)
+                    for dias in PERIODOS_GRAFICO:
+                        cache.delete_memoized(AnalisadorInvestimentos.obter_grafico_segmento,
+                                              id_segmento, dias)
+                        AnalisadorInvestimentos.obter_grafico_segmento(id_segmento, dias)
+            logger.info(f"✓ Cache da aplicação invalidado para {len(ids_segmentos)} segmento(s)")
+            
+        except Exception as e:
+            logger.warning(f"⚠ Não foi possível invalidar o cache da aplicação: {e}")
 
 # =====================================================
 # FUNÇÃO PRINCIPAL PARA EXECUTAR A COLETA
@@ -325,6 +590,7 @@ def executar_coleta_completa():
     
     # Criar coletor
     collector = YahooFinanceCollector(connection_string)
+    collector.garantir_indices_performance()
     
     logger.info("\n" + "="*60)
     logger.info("🚀 INICIANDO COLETA DE DADOS DO YAHOO FINANCE")
@@ -430,37 +696,49 @@ def executar_coleta_completa():
         'Mercado Amplo - Brasil': 'Índices amplos do mercado brasileiro'
     }
     
-    segmentos_ids = {}
-    for nome, descricao in segmentos_info.items():
-        segmentos_ids[nome] = collector.criar_segmento(nome, descricao)
+    segmentos_ids = collector.criar_segmentos(segmentos_info)
     
     # ================================================
     # COLETAR DADOS DE CADA ÍNDICE
     # ================================================
     total_indices = len(indices_para_coletar)
     
+    # Um único download paralelo para todos os tickers (2 anos de dados)
+    dados_baixados = collector.baixar_lote(
+        [indice_info['ticker'] for indice_info in indices_para_coletar],
+        periodo="2y"
+    )
+    
+    tickers_atualizados = []
     for idx, indice_info in enumerate(indices_para_coletar, 1):
         logger.info(f"\n[{idx}/{total_indices}] Processando índice...")
         
         # Coletar dados do índice
-        collector.coletar_indice_completo(
+        registros_inseridos = collector.coletar_indice_completo(
             ticker=indice_info['ticker'],
             descricao=indice_info['descricao'],
             pais=indice_info['pais'],
-            periodo="2y"  # 2 anos de dados
+            periodo="2y",
+            df=dados_baixados.get(indice_info['ticker'])
         )
-        
-        # Associar ao segmento
-        id_segmento = segmentos_ids.get(indice_info['segmento'])
-        if id_segmento:
-            collector.associar_indice_segmento(
-                ticker=indice_info['ticker'],
-                id_segmento=id_segmento
-            )
-        
-        # Delay para não sobrecarregar a API
-        if idx < total_indices:
-            time.sleep(1)
+        if registros_inseridos > 0:
+            tickers_atualizados.append(indice_info['ticker'])
+    
+    # ================================================
+    # ASSOCIAR ÍNDICES AOS SEGMENTOS
+    # ================================================
+    collector.associar_indices_segmento([
+        (indice_info['ticker'], segmentos_ids[indice_info['segmento']], 100.0)
+        for indice_info in indices_para_coletar
+        if indice_info['segmento'] in segmentos_ids
+    ])
+    
+    # ================================================
+    # PRÉ-CALCULAR OPORTUNIDADES (só segmentos que receberam dados novos)
+    # ================================================
+    segmentos_atualizados = collector.segmentos_dos_tickers(tickers_atualizados)
+    collector.atualizar_oportunidades(segmentos_atualizados)
+    collector.invalidar_cache_segmentos(segmentos_atualizados)
     
     logger.info("\n" + "="*60)
     logger.info("✅ COLETA CONCLUÍDA COM SUCESSO!")
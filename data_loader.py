@@ -1,8 +1,18 @@
-import yfinance as yf
+import asyncio
 import pandas as pd
 import pyodbc
-from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from urllib.parse import quote, quote_plus
+from datetime import date, datetime, timedelta
 import logging
+import os
+import tempfile
+from itertools import chain
+
+from cache_arquivos import FileCache
+from limitador_taxa import limitador_yahoo
+from lote_yahoo import baixar_lote_limitado
 
 # =====================================================
 # CONFIGURAÇÃO DE LOGGING
@@ -13,6 +23,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+URL_CHART_YAHOO = 'https://query1.finance.yahoo.com/v8/finance/chart/{ticker}'
+
+# Tipos do histórico baixado, iguais nos dois caminhos de download. Os preços
+# ficam em float64: float32 (~7 dígitos) não preserva as 4 casas de DECIMAL(18,4)
+SCHEMA_HISTORICO = {
+    'DataQuotacao': 'datetime64[ns]',
+    'Abertura': 'float64',
+    'Alta': 'float64',
+    'Baixa': 'float64',
+    'Fechamento': 'float64',
+    'FechamentoAjustado': 'float64'
+}
+
 # =====================================================
 # CONFIGURAÇÃO DO BANCO DE DADOS
 # =====================================================
@@ -26,18 +49,28 @@ class DatabaseConfig:
         self.username = username
         self.password = password
         self.driver = '{ODBC Driver 17 for SQL Server}'
+        self._engine = None
     
     def get_connection_string(self):
         """Retorna string de conexão para SQL Server"""
         return f'Driver={self.driver};Server={self.server};Database={self.database};UID={self.username};PWD={self.password}'
     
+    @property
+    def engine(self):
+        """Engine SQLAlchemy (QueuePool) criado uma única vez por configuração"""
+        if self._engine is None:
+            url = f"mssql+pyodbc:///?odbc_connect={quote_plus(self.get_connection_string())}"
+            self._engine = create_engine(url, pool_size=4, pool_pre_ping=True,
+                                         fast_executemany=True)
+        return self._engine
+    
     def get_connection(self):
-        """Cria e retorna uma conexão com o banco de dados"""
+        """Retorna uma conexão pyodbc do pool (close() a devolve ao pool)"""
         try:
-            conn = pyodbc.connect(self.get_connection_string())
+            conn = self.engine.raw_connection()
             logger.info("✓ Conexão com SQL Server estabelecida")
             return conn
-        except pyodbc.Error as e:
+        except (pyodbc.Error, SQLAlchemyError) as e:
             logger.error(f"✗ Erro ao conectar ao SQL Server: {e}")
             raise
 
@@ -47,8 +80,9 @@ class DatabaseConfig:
 class IndiceManager:
     """Gerencia operações com índices de mercado"""
     
-    def __init__(self, db_config):
+    def __init__(self, db_config, cache=None):
         self.db_config = db_config
+        self.cache = cache or FileCache()
         self.tickers_info = {
             '^NYA': {'Descricao': 'NYSE Composite Index', 'Pais': 'Estados Unidos'},
             '^IXIC': {'Descricao': 'Nasdaq Composite Index', 'Pais': 'Estados Unidos'},
@@ -61,68 +95,237 @@ class IndiceManager:
             '^DJI': {'Descricao': 'Dow Jones Industrial Average', 'Pais': 'Estados Unidos'},
             '^GSPC': {'Descricao': 'S&P 500 Index', 'Pais': 'Estados Unidos'}
         }
+        # Colunas textuais como categorias fixas: um código inteiro por linha, e
+        # os frames de cada ticker concatenam sem voltar a object
+        self.tipos_categoricos = {
+            'Ticker': pd.CategoricalDtype(list(self.tickers_info)),
+            'Descricao': pd.CategoricalDtype([i['Descricao'] for i in self.tickers_info.values()]),
+            'Pais': pd.CategoricalDtype(list(dict.fromkeys(i['Pais'] for i in self.tickers_info.values())))
+        }
+    
+    def data_inicio_incremental(self, start_date):
+        """Retorna a data a partir da qual ainda faltam dados no banco para algum índice"""
+        try:
+            conn = self.db_config.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT i.Ticker, MAX(hp.DataQuotacao)
+                    FROM Indices i
+                    LEFT JOIN HistoricoPrecos hp ON i.IdIndice = hp.IdIndice
+                    GROUP BY i.Ticker
+                """)
+                ultimas_datas = dict(cursor.fetchall())
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠ Não foi possível consultar a última carga, baixando desde {start_date}: {e}")
+            return start_date
+        
+        datas = [ultimas_datas.get(ticker) for ticker in self.tickers_info]
+        if any(data is None for data in datas):
+            return start_date
+        
+        return max(start_date, min(datas).isoformat())
+    
+    def _aplica_schema(self, df):
+        """Converte o histórico baixado para os tipos de SCHEMA_HISTORICO e categorias"""
+        df = df.astype({**SCHEMA_HISTORICO, **self.tipos_categoricos})
+        # Volume cabe em inteiro menor na maioria dos índices
+        df['Volume'] = pd.to_numeric(df['Volume'].fillna(0), downcast='integer')
+        return df
     
     def baixar_dados_indices(self, start_date='2008-08-01', end_date='2025-11-24'):
         """Baixa dados históricos de todos os índices"""
-        dados_completos = []
-        
         logger.info(f"Iniciando download de dados de {start_date} a {end_date}...\n")
         
-        for ticker, info in self.tickers_info.items():
-            logger.info(f"Baixando {ticker} - {info['Descricao']}...")
+        # Reaproveitar do cache em disco o que já foi baixado para este período
+        dados_brutos = {}
+        for ticker in self.tickers_info:
+            df_cache = self.cache.obter(ticker, start_date, end_date)
+            if df_cache is not None:
+                dados_brutos[ticker] = df_cache
+        
+        faltantes = [ticker for ticker in self.tickers_info if ticker not in dados_brutos]
+        if dados_brutos:
+            logger.info(f"✓ {len(dados_brutos)} índices carregados do cache local")
+        
+        # Download em lote: o yfinance busca os tickers em paralelo (threads),
+        # em grupos limitados pelo limitador_yahoo
+        if faltantes:
             try:
-                df = yf.download(ticker, start=start_date, end=end_date, 
-                               progress=False, auto_adjust=False)
-                
-                if not df.empty:
-                    df = df.reset_index()
-                    
-                    # Achatar colunas se for MultiIndex
-                    if isinstance(df.columns, pd.MultiIndex):
-                        df.columns = df.columns.get_level_values(0)
-                    
-                    # Renomear Adj Close
-                    if 'Adj Close' not in df.columns:
-                        for col in df.columns:
-                            if 'adj' in str(col).lower() and 'close' in str(col).lower():
-                                df.rename(columns={col: 'Adj Close'}, inplace=True)
-                                break
-                    
-                    df['Ticker'] = ticker
-                    df['Descricao'] = info['Descricao']
-                    df['Pais'] = info['Pais']
-                    
-                    # Renomear colunas para padrão SQL
-                    df = df.rename(columns={
-                        'Date': 'DataQuotacao',
-                        'Open': 'Abertura',
-                        'High': 'Alta',
-                        'Low': 'Baixa',
-                        'Close': 'Fechamento',
-                        'Adj Close': 'FechamentoAjustado',
-                        'Volume': 'Volume'
-                    })
-                    
-                    colunas_mantidas = ['Ticker', 'Descricao', 'Pais', 'DataQuotacao', 
-                                      'Abertura', 'Alta', 'Baixa', 'Fechamento', 
-                                      'FechamentoAjustado', 'Volume']
-                    
-                    df = df[colunas_mantidas]
-                    dados_completos.append(df)
-                    logger.info(f"  ✓ {ticker}: {len(df)} registros baixados")
-                else:
-                    logger.warning(f"  ✗ {ticker}: Sem dados disponíveis")
-                    
+                baixados = baixar_lote_limitado(faltantes, start=start_date, end=end_date,
+                                                auto_adjust=False)
             except Exception as e:
-                logger.error(f"  ✗ Erro em {ticker}: {str(e)}")
+                logger.error(f"❌ Erro no download em lote: {str(e)}")
+                return None
+            
+            for ticker, df in baixados.items():
+                dados_brutos[ticker] = df
+                # Falha/429 no lote vem como frame vazio: não pode ficar no cache
+                if not df.empty:
+                    self.cache.salvar(ticker, start_date, end_date, df)
         
-        if dados_completos:
-            df_final = pd.concat(dados_completos, ignore_index=True)
-            logger.info(f"\n📊 Total de registros antes de limpeza: {len(df_final):,}")
-            return df_final
-        else:
+        sem_dados = [ticker for ticker in self.tickers_info
+                     if ticker not in dados_brutos or dados_brutos[ticker].empty]
+        for ticker in sem_dados:
+            dados_brutos.pop(ticker, None)
+        if sem_dados:
+            logger.warning("  ✗ Sem dados disponíveis: %s", ", ".join(sem_dados))
+        
+        if not dados_brutos:
             logger.error("❌ Nenhum dado foi baixado")
             return None
+        
+        # Formato longo (Data, Ticker) em uma única operação vetorizada
+        df_final = (
+            pd.concat(dados_brutos, axis=1)
+            .stack(level=0, future_stack=True)
+            .rename_axis(index=['DataQuotacao', 'Ticker'], columns=None)
+            .reset_index()
+            .rename(columns={
+                'Open': 'Abertura',
+                'High': 'Alta',
+                'Low': 'Baixa',
+                'Close': 'Fechamento',
+                'Adj Close': 'FechamentoAjustado'
+            })
+        )
+        
+        # O alinhamento das datas entre tickers gera linhas sem pregão
+        colunas_preco = ['Abertura', 'Alta', 'Baixa', 'Fechamento', 'FechamentoAjustado', 'Volume']
+        df_final = df_final.dropna(subset=colunas_preco, how='all')
+        
+        # Com Ticker categórico o map percorre só as categorias, não as linhas
+        df_final['Ticker'] = df_final['Ticker'].astype(self.tipos_categoricos['Ticker'])
+        df_final['Descricao'] = df_final['Ticker'].map({t: i['Descricao'] for t, i in self.tickers_info.items()})
+        df_final['Pais'] = df_final['Ticker'].map({t: i['Pais'] for t, i in self.tickers_info.items()})
+        
+        colunas_mantidas = ['Ticker', 'Descricao', 'Pais', 'DataQuotacao', 
+                          'Abertura', 'Alta', 'Baixa', 'Fechamento', 
+                          'FechamentoAjustado', 'Volume']
+        df_final = df_final[colunas_mantidas]
+        
+        df_final = self._aplica_schema(df_final)
+        
+        for ticker, total in df_final.groupby('Ticker', observed=True).size().items():
+            logger.info("  ✓ %s: %d registros baixados", ticker, total)
+        
+        logger.info(f"\n📊 Total de registros antes de limpeza: {len(df_final):,}")
+        return df_final
+    
+    async def _baixar_chart(self, session, semaforo, ticker, start_date, end_date):
+        """Baixa o histórico diário de um ticker direto da API de chart do Yahoo"""
+        params = {
+            'period1': int(pd.Timestamp(start_date).timestamp()),
+            'period2': int(pd.Timestamp(end_date).timestamp()),
+            'interval': '1d',
+            'events': 'history',
+            'includeAdjustedClose': 'true'
+        }
+        
+        async with semaforo:
+            await limitador_yahoo.adquirir_async()
+            async with session.get(URL_CHART_YAHOO.format(ticker=quote(ticker)), params=params) as resposta:
+                resposta.raise_for_status()
+                payload = await resposta.json()
+        
+        resultado = payload['chart']['result'][0]
+        if 'timestamp' not in resultado:
+            return pd.DataFrame()
+        
+        cotacoes = resultado['indicators']['quote'][0]
+        # Timestamps em UTC; o deslocamento da bolsa leva ao dia do pregão local
+        deslocamento = resultado['meta'].get('gmtoffset', 0)
+        info = self.tickers_info[ticker]
+        
+        df = pd.DataFrame({
+            'Ticker': ticker,
+            'Descricao': info['Descricao'],
+            'Pais': info['Pais'],
+            'DataQuotacao': pd.to_datetime(pd.Series(resultado['timestamp']) + deslocamento, unit='s').dt.normalize(),
+            'Abertura': cotacoes['open'],
+            'Alta': cotacoes['high'],
+            'Baixa': cotacoes['low'],
+            'Fechamento': cotacoes['close'],
+            'FechamentoAjustado': resultado['indicators']['adjclose'][0]['adjclose'],
+            'Volume': cotacoes['volume']
+        })
+        
+        colunas_preco = ['Abertura', 'Alta', 'Baixa', 'Fechamento', 'FechamentoAjustado', 'Volume']
+        return self._aplica_schema(df.dropna(subset=colunas_preco, how='all'))
+    
+    async def baixar_e_carregar_async(self, repositorio, start_date='2008-08-01',
+                                      end_date='2025-11-24', concorrencia=8):
+        """
+        Baixa os índices em paralelo e grava cada um no banco assim que chega.
+        
+        Os downloads (aiohttp) e as gravações (pyodbc, bloqueante, em thread do
+        executor) se sobrepõem através de uma fila. Os índices já precisam estar
+        cadastrados em `Indices`.
+        
+        Returns:
+            Lista com os DataFrames gravados (para backup)
+        """
+        # Dependência só deste caminho (opcional): o carregamento padrão não a exige
+        import aiohttp
+        
+        logger.info(f"Iniciando download assíncrono de {start_date} a {end_date}...\n")
+        
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue()
+        semaforo = asyncio.Semaphore(concorrencia)
+        
+        async def gravador():
+            gravados = []
+            while True:
+                df = await fila.get()
+                if df is None:
+                    return gravados
+                # Uma gravação por vez: a conexão do repositório não é compartilhável
+                await loop.run_in_executor(None, repositorio.insere_historico_precos, df)
+                gravados.append(df)
+        
+        async def baixar(session, ticker):
+            try:
+                df = await self._baixar_chart(session, semaforo, ticker, start_date, end_date)
+            except Exception as e:
+                logger.error("  ✗ Erro em %s: %s", ticker, e)
+                return
+            
+            if df.empty:
+                logger.warning("  ✗ %s: Sem dados disponíveis", ticker)
+                return
+            
+            logger.info("  ✓ %s: %d registros baixados", ticker, len(df))
+            await fila.put(df)
+        
+        tarefa_gravador = asyncio.create_task(gravador())
+        async with aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'}) as session:
+            downloads = asyncio.gather(*(baixar(session, ticker) for ticker in self.tickers_info))
+            
+            # O gravador só termina antes dos downloads se falhar: aí não há quem
+            # consuma a fila, então os downloads restantes são cancelados
+            await asyncio.wait({downloads, tarefa_gravador}, return_when=asyncio.FIRST_COMPLETED)
+            if tarefa_gravador.done():
+                downloads.cancel()
+                await asyncio.gather(downloads, return_exceptions=True)
+            else:
+                await fila.put(None)
+        
+        return await tarefa_gravador
+    
+    def salvar_em_parquet(self, df, filename='indices_mercado_2008_2025.parquet'):
+        """Salva dados em Parquet (snappy)"""
+        try:
+            df.assign(DataQuotacao=pd.to_datetime(df['DataQuotacao'])).to_parquet(
+                filename, engine='pyarrow', compression='snappy', index=False
+            )
+            logger.info(f"✓ Arquivo Parquet salvo: {filename}")
+            return filename
+        except Exception as e:
+            logger.error(f"✗ Erro ao salvar Parquet: {e}")
+            raise
     
     def salvar_em_csv(self, df, filename='indices_mercado_2008_2025.csv'):
         """Salva dados em CSV"""
@@ -142,17 +345,32 @@ class RepositorioSQLServer:
     
     def __init__(self, db_config):
         self.db_config = db_config
+        # Uma conexão para toda a carga (autocommit desligado; commit por etapa)
+        self.conn = db_config.get_connection()
+        # Cadastro (Ticker, IdIndice) lido uma vez; invalidado ao inserir índices
+        self._indices_df = None
+    
+    def close(self):
+        """Fecha a conexão com o banco"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def insere_ou_atualiza_indice(self, df):
         """Insere ou atualiza informações de índices"""
-        conn = self.db_config.get_connection()
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         indices_unicos = df[['Ticker', 'Descricao', 'Pais']].drop_duplicates()
         
         logger.info(f"Inserindo/atualizando {len(indices_unicos)} índices...")
         
-        for _, row in indices_unicos.iterrows():
+        for ticker, descricao, pais in indices_unicos.itertuples(index=False, name=None):
             try:
                 cursor.execute('''
                     IF NOT EXISTS (SELECT 1 FROM Indices WHERE Ticker = ?)
@@ -160,67 +378,155 @@ class RepositorioSQLServer:
                         INSERT INTO Indices (Ticker, Descricao, Pais)
                         VALUES (?, ?, ?)
                     END
-                ''', row['Ticker'], row['Ticker'], row['Descricao'], row['Pais'])
+                ''', ticker, ticker, descricao, pais)
                 
             except Exception as e:
-                logger.error(f"Erro ao inserir índice {row['Ticker']}: {e}")
+                logger.error("Erro ao inserir índice %s: %s", ticker, e)
         
-        conn.commit()
+        self.conn.commit()
+        self._indices_df = None
         logger.info("✓ Índices processados com sucesso")
         cursor.close()
     
-    def insere_historico_precos(self, df):
-        """Insere dados históricos de preços"""
-        conn = self.db_config.get_connection()
-        cursor = conn.cursor()
+    def _prepara_historico(self, df):
+        """Resolve IdIndice e normaliza tipos das colunas de preço para carga"""
+        if self._indices_df is None:
+            self._indices_df = pd.read_sql("SELECT IdIndice, Ticker FROM Indices", self.db_config.engine)
+        
+        # Hash-join vetorizado; o indicador aponta os tickers sem cadastro
+        df = df.merge(self._indices_df, on='Ticker', how='left', indicator=True)
+        nao_encontrados = df.loc[df['_merge'] == 'left_only', 'Ticker'].unique()
+        if len(nao_encontrados):
+            logger.warning("Índices não encontrados: %s", ", ".join(nao_encontrados))
+        df = df[df['_merge'] == 'both']
+        
+        colunas = ['IdIndice', 'DataQuotacao', 'Abertura', 'Alta', 'Baixa',
+                   'Fechamento', 'FechamentoAjustado', 'Volume']
+        dados = df[colunas].assign(
+            IdIndice=df['IdIndice'].astype('int64'),
+            DataQuotacao=pd.to_datetime(df['DataQuotacao']).dt.date,
+            Volume=df['Volume'].fillna(0).astype('int64')
+        )
+        
+        # O MERGE insere todas as linhas repetidas do lote e violaria UQ_HistoricoPrecos
+        return dados.drop_duplicates(['IdIndice', 'DataQuotacao'], keep='last')
+    
+    def _cria_staging(self, cursor):
+        """Cria a tabela temporária #tmpHP na conexão do cursor"""
+        cursor.execute('''
+            IF OBJECT_ID('tempdb..#tmpHP') IS NOT NULL
+                DROP TABLE #tmpHP;
+            
+            CREATE TABLE #tmpHP (
+                IdIndice INT,
+                DataQuotacao DATE,
+                Abertura FLOAT,
+                Alta FLOAT,
+                Baixa FLOAT,
+                Fechamento FLOAT,
+                FechamentoAjustado FLOAT,
+                Volume BIGINT
+            )
+        ''')
+    
+    def _merge_staging(self, cursor):
+        """Move de #tmpHP para HistoricoPrecos os pares (índice, data) inexistentes"""
+        cursor.execute('''
+            MERGE HistoricoPrecos WITH (HOLDLOCK) AS tgt
+            USING #tmpHP AS src
+            ON tgt.IdIndice = src.IdIndice AND tgt.DataQuotacao = src.DataQuotacao
+            WHEN NOT MATCHED THEN
+                INSERT (IdIndice, DataQuotacao, Abertura, Alta, Baixa,
+                        Fechamento, FechamentoAjustado, Volume)
+                VALUES (src.IdIndice, src.DataQuotacao, src.Abertura, src.Alta, src.Baixa,
+                        src.Fechamento, src.FechamentoAjustado, src.Volume);
+        ''')
+        registros_inseridos = cursor.rowcount
+        cursor.execute("DROP TABLE #tmpHP")
+        return registros_inseridos
+    
+    def insere_historico_precos(self, df, tamanho_lote=10000):
+        """Insere dados históricos de preços (carga em lote via staging + MERGE)"""
+        cursor = self.conn.cursor()
+        cursor.fast_executemany = True
         
         logger.info(f"Inserindo {len(df)} registros de preços...")
         
-        # Buscar IDs dos índices
-        cursor.execute("SELECT IdIndice, Ticker FROM Indices")
-        indices_map = {row[1]: row[0] for row in cursor.fetchall()}
+        dados = self._prepara_historico(df)
+        dados = dados.astype(object).where(dados.notna(), None)
+        rows = list(dados.itertuples(index=False, name=None))
         
-        registros_inseridos = 0
-        registros_duplicados = 0
+        try:
+            self._cria_staging(cursor)
+            
+            # Carga no staging em lotes (fast_executemany)
+            for inicio in range(0, len(rows), tamanho_lote):
+                cursor.executemany(
+                    "INSERT INTO #tmpHP VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows[inicio:inicio + tamanho_lote]
+                )
+            
+            registros_inseridos = self._merge_staging(cursor)
+            registros_duplicados = len(rows) - registros_inseridos
+            
+            self.conn.commit()
+            logger.info(f"✓ {registros_inseridos} registros inseridos, {registros_duplicados} duplicados")
+            
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Erro ao inserir preços: {e}")
+            raise
+        finally:
+            cursor.close()
+    
+    def bulk_insert_historico(self, df, diretorio=None):
+        """
+        Insere dados históricos via BULK INSERT de um arquivo tabulado.
         
-        for _, row in df.iterrows():
-            try:
-                id_indice = indices_map.get(row['Ticker'])
-                if not id_indice:
-                    logger.warning(f"Índice {row['Ticker']} não encontrado")
-                    continue
-                
-                data_quotacao = pd.to_datetime(row['DataQuotacao']).date()
-                
-                cursor.execute('''
-                    IF NOT EXISTS (SELECT 1 FROM HistoricoPrecos 
-                                 WHERE IdIndice = ? AND DataQuotacao = ?)
-                    BEGIN
-                        INSERT INTO HistoricoPrecos 
-                        (IdIndice, DataQuotacao, Abertura, Alta, Baixa, Fechamento, FechamentoAjustado, Volume)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    END
-                ''', id_indice, data_quotacao, id_indice, data_quotacao,
-                    row['Abertura'], row['Alta'], row['Baixa'], 
-                    row['Fechamento'], row['FechamentoAjustado'], int(row['Volume']))
-                
-                if cursor.rowcount > 0:
-                    registros_inseridos += 1
-                else:
-                    registros_duplicados += 1
-                    
-            except Exception as e:
-                logger.error(f"Erro ao inserir preço: {e}")
+        Indicado para a carga histórica completa (milhões de linhas). O arquivo
+        é lido pelo próprio SQL Server, portanto `diretorio` precisa ser
+        acessível pelo serviço do banco (padrão: diretório temporário local).
+        """
+        cursor = self.conn.cursor()
         
-        conn.commit()
-        logger.info(f"✓ {registros_inseridos} registros inseridos, {registros_duplicados} duplicados")
-        cursor.close()
-        conn.close()
+        logger.info(f"Inserindo {len(df)} registros de preços via BULK INSERT...")
+        
+        dados = self._prepara_historico(df)
+        
+        fd, caminho = tempfile.mkstemp(suffix='.tsv', dir=diretorio)
+        os.close(fd)
+        
+        try:
+            dados.to_csv(caminho, sep='\t', index=False, header=False,
+                         date_format='%Y-%m-%d', encoding='utf-8', lineterminator='\n')
+            
+            # BULK INSERT não aceita parâmetro no caminho: escapar aspas do literal
+            caminho_sql = os.path.abspath(caminho).replace("'", "''")
+            
+            self._cria_staging(cursor)
+            cursor.execute(f'''
+                BULK INSERT #tmpHP FROM '{caminho_sql}'
+                WITH (FIELDTERMINATOR = '\\t', ROWTERMINATOR = '0x0a',
+                      KEEPNULLS, TABLOCK, BATCHSIZE = 50000)
+            ''')
+            
+            registros_inseridos = self._merge_staging(cursor)
+            registros_duplicados = len(dados) - registros_inseridos
+            
+            self.conn.commit()
+            logger.info(f"✓ {registros_inseridos} registros inseridos, {registros_duplicados} duplicados")
+            
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Erro no BULK INSERT de preços: {e}")
+            raise
+        finally:
+            cursor.close()
+            os.remove(caminho)
     
     def vincular_indices_segmentos(self):
         """Vincula índices aos segmentos apropriados"""
-        conn = self.db_config.get_connection()
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         # Mapeamento de tickers para segmentos
         ticker_segmento = {
@@ -231,76 +537,87 @@ class RepositorioSQLServer:
         
         logger.info("Vinculando índices aos segmentos...")
         
-        for ticker, segmento in ticker_segmento.items():
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (SELECT 1 FROM IndicesSegmentos 
-                                 WHERE IdIndice = (SELECT IdIndice FROM Indices WHERE Ticker = ?)
-                                 AND IdSegmento = (SELECT IdSegmento FROM SegmentosInvestimento WHERE Nome = ?))
-                    BEGIN
-                        INSERT INTO IndicesSegmentos (IdIndice, IdSegmento)
-                        SELECT IdIndice FROM Indices WHERE Ticker = ?,
-                               (SELECT IdSegmento FROM SegmentosInvestimento WHERE Nome = ?)
-                    END
-                ''', ticker, segmento, ticker, segmento)
-                
-            except Exception as e:
-                logger.error(f"Erro ao vincular {ticker} a {segmento}: {e}")
+        # Um único INSERT...SELECT sobre uma tabela VALUES resolve todos os pares
+        valores = ", ".join(["(?, ?)"] * len(ticker_segmento))
+        try:
+            cursor.execute(f'''
+                INSERT INTO IndicesSegmentos (IdIndice, IdSegmento)
+                SELECT i.IdIndice, s.IdSegmento
+                FROM (VALUES {valores}) AS v (Ticker, Nome)
+                JOIN Indices i ON i.Ticker = v.Ticker
+                JOIN SegmentosInvestimento s ON s.Nome = v.Nome
+                WHERE NOT EXISTS (SELECT 1 FROM IndicesSegmentos x
+                                  WHERE x.IdIndice = i.IdIndice AND x.IdSegmento = s.IdSegmento)
+            ''', list(chain.from_iterable(ticker_segmento.items())))
+            logger.info(f"  {cursor.rowcount} vínculos novos")
+            
+        except Exception as e:
+            logger.error(f"Erro ao vincular índices aos segmentos: {e}")
         
-        conn.commit()
+        self.conn.commit()
         logger.info("✓ Segmentos vinculados com sucesso")
         cursor.close()
-        conn.close()
     
     def gera_relatorio_carregamento(self):
         """Gera relatório do carregamento de dados"""
-        conn = self.db_config.get_connection()
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         logger.info("\n" + "="*60)
         logger.info("📊 RELATÓRIO DE CARREGAMENTO DE DADOS")
         logger.info("="*60)
         
+        # Os quatro resultados do relatório em um único lote (uma ida ao servidor)
+        cursor.execute("""
+            SELECT COUNT(*) FROM Indices WHERE Ativo = 1;
+            SELECT COUNT(*) FROM HistoricoPrecos;
+            SELECT MIN(DataQuotacao), MAX(DataQuotacao) FROM HistoricoPrecos;
+            SELECT i.Ticker, i.Descricao, COUNT(hp.IdIndice) as Total
+            FROM Indices i
+            LEFT JOIN HistoricoPrecos hp ON i.IdIndice = hp.IdIndice
+            GROUP BY i.IdIndice, i.Ticker, i.Descricao
+            ORDER BY Total DESC;
+        """)
+        
         # Total de índices
-        cursor.execute("SELECT COUNT(*) FROM Indices WHERE Ativo = 1")
         total_indices = cursor.fetchone()[0]
         logger.info(f"Total de Índices: {total_indices}")
         
         # Total de registros históricos
-        cursor.execute("SELECT COUNT(*) FROM HistoricoPrecos")
+        cursor.nextset()
         total_historico = cursor.fetchone()[0]
         logger.info(f"Total de Registros Históricos: {total_historico:,}")
         
         # Período de dados
-        cursor.execute("""
-            SELECT MIN(DataQuotacao), MAX(DataQuotacao) 
-            FROM HistoricoPrecos
-        """)
+        cursor.nextset()
         min_date, max_date = cursor.fetchone()
         logger.info(f"Período: {min_date} a {max_date}")
         
         # Registros por índice
         logger.info("\nRegistros por Índice:")
-        cursor.execute("""
-            SELECT i.Ticker, i.Descricao, COUNT(*) as Total
-            FROM Indices i
-            LEFT JOIN HistoricoPrecos hp ON i.IdIndice = hp.IdIndice
-            GROUP BY i.IdIndice, i.Ticker, i.Descricao
-            ORDER BY Total DESC
-        """)
+        cursor.nextset()
         
-        for ticker, desc, total in cursor.fetchall():
-            logger.info(f"  {ticker:12} - {desc:35} : {total:,} registros")
+        linhas = cursor.fetchall()
+        # Separador de milhar formatado só se a linha for de fato emitida
+        if logger.isEnabledFor(logging.INFO):
+            for ticker, desc, total in linhas:
+                logger.info("  %-12s - %-35s : %s registros", ticker, desc, format(total, ','))
         
         cursor.close()
-        conn.close()
         logger.info("="*60 + "\n")
 
 # =====================================================
 # EXECUÇÃO PRINCIPAL
 # =====================================================
-def main():
-    """Função principal do script"""
+def main(exportar_csv=False, pipeline_async=False, diretorio_bulk=None):
+    """
+    Função principal do script
+    
+    Args:
+        exportar_csv: Também grava o backup em CSV (para abrir em planilhas)
+        pipeline_async: Sobrepõe downloads (aiohttp) e gravações no banco
+        diretorio_bulk: Pasta acessível pelo serviço do SQL Server; quando
+            informada, a carga histórica completa usa BULK INSERT
+    """
     
     try:
         # Configurar banco de dados
@@ -311,25 +628,71 @@ def main():
             password='YourPassword123!'  # ALTERAR CONFORME SEU AMBIENTE
         )
         
-        # Etapa 1: Baixar dados
         indice_manager = IndiceManager(db_config)
-        df_indices = indice_manager.baixar_dados_indices()
+        start_date = indice_manager.data_inicio_incremental('2008-08-01')
+        
+        # Carga incremental vai até hoje e para um arquivo próprio, sem
+        # sobrescrever o backup completo
+        if start_date == '2008-08-01':
+            end_date = '2025-11-24'
+            nome_backup = 'indices_mercado_2008_2025'
+        else:
+            end_date = (date.today() + timedelta(days=1)).isoformat()
+            nome_backup = f'indices_mercado_desde_{start_date}'
+        
+        if pipeline_async:
+            with RepositorioSQLServer(db_config) as repositorio:
+                # Etapa 1: Cadastrar os índices antes de gravar os preços
+                repositorio.insere_ou_atualiza_indice(
+                    pd.DataFrame.from_dict(indice_manager.tickers_info, orient='index')
+                    .rename_axis('Ticker').reset_index()
+                )
+                
+                # Etapa 2: Baixar e inserir sobrepostos
+                gravados = asyncio.run(
+                    indice_manager.baixar_e_carregar_async(repositorio, start_date=start_date,
+                                                          end_date=end_date)
+                )
+                if not gravados:
+                    logger.error("Falha ao baixar dados")
+                    return
+                repositorio.vincular_indices_segmentos()
+                
+                # Etapa 3: Gerar relatório
+                repositorio.gera_relatorio_carregamento()
+            
+            # Etapa 4: Salvar backup
+            df_indices = pd.concat(gravados, ignore_index=True)
+            indice_manager.salvar_em_parquet(df_indices, f'{nome_backup}.parquet')
+            if exportar_csv:
+                indice_manager.salvar_em_csv(df_indices, f'{nome_backup}.csv')
+            
+            logger.info("✅ PROCESSO CONCLUÍDO COM SUCESSO!")
+            return
+        
+        # Etapa 1: Baixar dados
+        df_indices = indice_manager.baixar_dados_indices(start_date=start_date, end_date=end_date)
         
         if df_indices is None:
             logger.error("Falha ao baixar dados")
             return
         
-        # Etapa 2: Salvar em CSV (backup)
-        csv_file = indice_manager.salvar_em_csv(df_indices)
+        # Etapa 2: Salvar backup (Parquet; CSV apenas sob demanda)
+        indice_manager.salvar_em_parquet(df_indices, f'{nome_backup}.parquet')
+        if exportar_csv:
+            indice_manager.salvar_em_csv(df_indices, f'{nome_backup}.csv')
         
         # Etapa 3: Inserir no SQL Server
-        repositorio = RepositorioSQLServer(db_config)
-        repositorio.insere_ou_atualiza_indice(df_indices)
-        repositorio.insere_historico_precos(df_indices)
-        repositorio.vincular_indices_segmentos()
-        
-        # Etapa 4: Gerar relatório
-        repositorio.gera_relatorio_carregamento()
+        with RepositorioSQLServer(db_config) as repositorio:
+            repositorio.insere_ou_atualiza_indice(df_indices)
+            if diretorio_bulk and start_date == '2008-08-01':
+                repositorio.bulk_insert_historico(df_indices, diretorio=diretorio_bulk)
+            else:
+                repositorio.insere_historico_precos(df_indices)
+            repositorio.vincular_indices_segmentos()
+            
+            # Etapa 4: Gerar relatório
+            repositorio.gera_relatorio_carregamento()
         
         logger.info("✅ PROCESSO CONCLUÍDO COM SUCESSO!")
         
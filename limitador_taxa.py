@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import time
+
+# =====================================================
+# LIMITE DE TAXA DAS CHAMADAS AO YAHOO FINANCE
+# =====================================================
+class LimitadorTaxa:
+    """Token bucket: permite rajadas de até `capacidade` chamadas e limita a `taxa` por segundo"""
+    
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _reservar(self) -> float:
+        """Consome um token se houver; senão retorna quantos segundos esperar"""
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.taxa
+    
+    def adquirir(self, quantidade: int = 1):
+        """Bloqueia a thread até consumir `quantidade` tokens (um por requisição)"""
+        for _ in range(quantidade):
+            espera = self._reservar()
+            while espera > 0:
+                time.sleep(espera)
+                espera = self._reservar()
+    
+    async def adquirir_async(self):
+        """Aguarda (sem bloquear o event loop) até haver um token disponível e o consome"""
+        espera = self._reservar()
+        while espera > 0:
+            await asyncio.sleep(espera)
+            espera = self._reservar()
+
+# Cota de chamadas ao Yahoo compartilhada por threads e corrotinas do processo
+limitador_yahoo = LimitadorTaxa(taxa=5, capacidade=5)
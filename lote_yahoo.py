@@ -0,0 +1,60 @@
+from typing import Dict, List
+
+import pandas as pd
+import yfinance as yf
+
+from limitador_taxa import limitador_yahoo
+
+# =====================================================
+# DOWNLOAD EM LOTE DO YAHOO FINANCE
+# =====================================================
+def separar_lote(df_lote: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Separa o resultado de um yf.download(..., group_by='ticker') em um DataFrame
+    por ticker (indexado pela data)
+    
+    Args:
+        df_lote: DataFrame retornado pelo yf.download
+        tickers: Símbolos pedidos, na mesma ordem do download
+        
+    Returns:
+        Dicionário ticker -> DataFrame; tickers ausentes do lote ficam de fora
+    """
+    # Garantir colunas no formato (Ticker, Campo) mesmo para um único ticker
+    if not isinstance(df_lote.columns, pd.MultiIndex):
+        df_lote = pd.concat({tickers[0]: df_lote}, axis=1)
+    
+    tickers_baixados = set(df_lote.columns.get_level_values(0))
+    
+    # O lote alinha as datas de todos os tickers; descartar dias sem pregão
+    return {
+        ticker: df_lote[ticker].dropna(how='all')
+        for ticker in tickers
+        if ticker in tickers_baixados
+    }
+
+def baixar_lote_limitado(tickers: List[str], **kwargs) -> Dict[str, pd.DataFrame]:
+    """
+    Baixa vários tickers com yf.download respeitando o limitador_yahoo
+    
+    O yf.download dispara uma requisição por ticker em threads próprias; por isso
+    o lote é dividido em grupos de no máximo `capacidade` tickers e cada grupo
+    consome um token por ticker antes de sair.
+    
+    Args:
+        tickers: Símbolos a baixar
+        **kwargs: Parâmetros repassados ao yf.download (period, start, end, auto_adjust...)
+        
+    Returns:
+        Dicionário ticker -> DataFrame (ver separar_lote)
+    """
+    frames = {}
+    tamanho_grupo = limitador_yahoo.capacidade
+    
+    for inicio in range(0, len(tickers), tamanho_grupo):
+        grupo = tickers[inicio:inicio + tamanho_grupo]
+        limitador_yahoo.adquirir(len(grupo))
+        df_lote = yf.download(grupo, group_by='ticker', threads=True, progress=False, **kwargs)
+        frames.update(separar_lote(df_lote, grupo))
+    
+    return frames